@@ -4,18 +4,24 @@
 Create a deterministic .pkg from a package source dir, always using local build/arch.
 
 Usage:
-  scripts/create_package.py <src_dir> [--out-root pkgs] [--keep-temp]
+  scripts/create_package.py <src_dir> [--out-root pkgs] [--keep-temp] [--batch-file FILE]
 
 Behavior:
 - Expects a manifest.acl file at the top of <src_dir>.
 - Produces <out_root>/<name>/<ver>/<name>-<ver>.pkg
-- ALWAYS uses build/arch. If build/arch is missing, attempts to compile src/arch.c -> build/arch.
+- ALWAYS uses build/arch. If build/arch is missing, or too old to support `pack -`
+  (checked via `build/arch --version`), attempts to compile src/core/arch.c -> build/arch.
 - If compilation or arch invocation fails, the script exits with non-zero (no tar fallback).
-- Computes SHA256 and updates (or inserts) archive_sha256 in manifest.acl.
+- arch writes the archive to stdout; it is hashed while being written to disk, and the
+  SHA256 is then updated (or inserted) as archive_sha256 in manifest.acl.
+- With --batch-file, arch is not run: an "<out_pkg>\t<src_dir>" line is appended to FILE
+  instead, and scripts/pack_batch.py later packs every queued package with one arch process.
 """
 from __future__ import annotations
 import argparse
+import functools
 import hashlib
+import mmap
 import os
 import re
 import shutil
@@ -23,15 +29,36 @@ import subprocess
 import sys
 import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import Callable, List, Optional, Tuple
 
 # -------- utility functions --------
 
+# files at least this large are hashed through mmap; smaller ones aren't worth the mapping setup
+MMAP_THRESHOLD = 16 * 4096
+
+# fresh sha256 state; copy() it instead of constructing a new hasher per file
+_SHA256_PROTO = hashlib.sha256()
+
 def compute_sha256(path: Path) -> str:
-    h = hashlib.sha256()
+    h = _SHA256_PROTO.copy()
     with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(64 * 1024), b""):
-            h.update(chunk)
+        # mmap lets hashlib read straight from the page cache without a copy per chunk;
+        # small files (and anything unmappable) are read in chunks instead.
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    h.update(mm)
+                return h.hexdigest()
+            except (OSError, ValueError):
+                pass
+        if sys.version_info >= (3, 11):
+            # C-level read/update loop with the GIL released
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        # read into one reused 1 MiB buffer rather than allocating a bytes object per chunk
+        buf = bytearray(1 << 20)
+        view = memoryview(buf)
+        while n := f.readinto(buf):
+            h.update(view[:n])
     return h.hexdigest()
 
 def find_manifest(src: Path) -> Path:
@@ -40,88 +67,222 @@ def find_manifest(src: Path) -> Path:
         return m
     raise FileNotFoundError(f"manifest.acl not found in {src}")
 
+# an existing `[string] archive_sha[256] = "...";` line, and the opening line of a top-level block.
+# Manifests are edited as bytes so the file never goes through a text decode/encode round trip.
+_ARCHIVE_SHA_LINE_RE = re.compile(rb'\s*(string\s+)?archive_sha(?:256)?\s*=\s*".*"\s*;\s*$')
+_TOP_BLOCK_RE = re.compile(rb'^[A-Za-z_][A-Za-z0-9_]*\s*\{', re.MULTILINE)
+
 def update_manifest_archive_sha(manifest_path: Path, sha_hex: str) -> None:
-    text = manifest_path.read_text(encoding="utf-8")
-    new_line = f'    string archive_sha256 = "{sha_hex}";'
-    pat = re.compile(r'^\s*(string\s+)?archive_sha(?:256)?\s*=\s*".*"\s*;\s*$', re.MULTILINE)
-    if pat.search(text):
-        text = pat.sub(new_line, text, count=1)
+    """
+    Replace the first archive_sha/archive_sha256 line in manifest_path with the new sha,
+    or insert one before the first top-level block's closing brace (or at EOF).
+    Only that one line is rewritten; blank lines around it are left untouched.
+    """
+    data = manifest_path.read_bytes()
+    new_line = f'    string archive_sha256 = "{sha_hex}";'.encode("ascii")
+    lines = data.splitlines(keepends=True)
+    for n, line in enumerate(lines):
+        if b"archive_sha" in line and _ARCHIVE_SHA_LINE_RE.match(line):
+            lines[n] = new_line + line[len(line.rstrip(b"\r\n")):]
+            new_data = b"".join(lines)
+            break
     else:
         # insert before the first top-level closing brace if possible
-        m = re.search(r'^[A-Za-z_][A-Za-z0-9_]*\s*\{', text, re.MULTILINE)
+        m = _TOP_BLOCK_RE.search(data)
         if m:
-            start = m.end()
             depth = 1
-            i = start
-            while i < len(text) and depth > 0:
-                if text[i] == '{':
+            i = m.end()
+            while depth > 0:
+                close = data.find(b'}', i)
+                if close < 0:
+                    break
+                open_ = data.find(b'{', i, close)
+                if open_ >= 0:
                     depth += 1
-                elif text[i] == '}':
+                    i = open_ + 1
+                else:
                     depth -= 1
-                i += 1
-            insert_at = i - 1 if depth == 0 else len(text)
-            insert_text = "\n    " + new_line.strip() + "\n"
-            text = text[:insert_at] + insert_text + text[insert_at:]
+                    i = close + 1
+            insert_at = i - 1 if depth == 0 else len(data)
+            insert_text = b"\n    " + new_line.strip() + b"\n"
+            new_data = data[:insert_at] + insert_text + data[insert_at:]
         else:
-            if not text.endswith("\n"):
-                text += "\n"
-            text += new_line + "\n"
-    manifest_path.write_text(text, encoding="utf-8")
+            new_data = data
+            if not new_data.endswith(b"\n"):
+                new_data += b"\n"
+            new_data += new_line + b"\n"
+    if new_data != data:
+        manifest_path.write_bytes(new_data)
 
 def ensure_parent(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
 
 # -------- arch build / invocation (always use build/arch) --------
 
+@functools.lru_cache(maxsize=64)
+def which(cmd: str) -> Optional[str]:
+    """shutil.which, memoized so repeated lookups don't re-walk PATH."""
+    return shutil.which(cmd)
+
+# arch archives start with this magic followed by a u64 entry count
+ARCH_MAGIC = b"PNDARCH\x01"
+ARCH_HEADER_LEN = len(ARCH_MAGIC) + 8
+# oldest `arch --version` that supports `pack -` (archive on stdout) and `pack-many`
+ARCH_MIN_VERSION = 2
+
+def is_arch_archive(path: Path) -> bool:
+    """True if path starts with a complete arch archive header."""
+    try:
+        with path.open("rb") as f:
+            head = f.read(ARCH_HEADER_LEN)
+    except OSError:
+        return False
+    return len(head) == ARCH_HEADER_LEN and head.startswith(ARCH_MAGIC)
+
+def arch_version(arch_path: Path) -> int:
+    """Return the version reported by `arch --version`, or 0 for binaries that predate it."""
+    try:
+        res = subprocess.run([str(arch_path), "--version"], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return 0
+    parts = res.stdout.split()
+    if res.returncode != 0 or len(parts) != 2 or parts[0] != b"arch" or not parts[1].isdigit():
+        return 0
+    return int(parts[1])
+
 def arch_executable() -> Path:
     """
-    Return the Path to build/arch. If missing, attempt to compile src/arch.c into it.
+    Return the Path to build/arch. If missing, or older than ARCH_MIN_VERSION,
+    attempt to compile src/core/arch.c into it.
     If compilation fails, raise RuntimeError.
     """
     out_path = Path("build") / "arch"
     if out_path.is_file() and os.access(out_path, os.X_OK):
-        return out_path
+        if arch_version(out_path) >= ARCH_MIN_VERSION:
+            return out_path
+        print(f"build/arch predates version {ARCH_MIN_VERSION}; rebuilding", file=sys.stderr)
 
-    # attempt to build from src/arch.c
-    src_c = Path("src") / "arch.c"
+    # attempt to build from src/core/arch.c
+    src_c = Path("src") / "core" / "arch.c"
     if not src_c.is_file():
-        raise RuntimeError("build/arch not found and src/arch.c missing; cannot proceed")
+        raise RuntimeError(f"build/arch missing or too old and {src_c} missing; cannot proceed")
 
     out_dir = out_path.parent
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # prefer cc/gcc/clang
-    cc = shutil.which("cc") or shutil.which("gcc") or shutil.which("clang")
+    cc = which("cc") or which("gcc") or which("clang")
     if not cc:
         raise RuntimeError("C compiler not found; cannot build build/arch")
 
     cmd = [cc, "-O2", "-std=c11", "-o", str(out_path), str(src_c)]
     print("Compiling arch:", " ".join(cmd), file=sys.stderr)
-    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if res.returncode != 0:
         print("Compilation of build/arch failed.", file=sys.stderr)
-        print("=== stdout ===", file=sys.stderr)
-        print(res.stdout, file=sys.stderr)
-        print("=== stderr ===", file=sys.stderr)
-        print(res.stderr, file=sys.stderr)
+        echo_output("=== stdout ===\n", res.stdout)
+        echo_output("=== stderr ===\n", res.stderr)
         raise RuntimeError("compilation failed for build/arch")
     out_path.chmod(0o755)
+    if arch_version(out_path) < ARCH_MIN_VERSION:
+        raise RuntimeError(f"freshly built build/arch does not report version >= {ARCH_MIN_VERSION}")
     return out_path
 
-def call_arch(arch_path: Path, src: Path, out_pkg: Path) -> int:
-    cmd = [str(arch_path), "pack", str(out_pkg), str(src)]
-    print("Running arch:", " ".join(cmd), file=sys.stderr)
+def echo_output(label: str, data: bytes) -> None:
+    """Echo captured subprocess output to stderr as raw bytes, without decoding it."""
+    print(label, end="", file=sys.stderr, flush=True)
+    buf = getattr(sys.stderr, "buffer", None)
+    if buf is None:
+        print(data.decode(errors="replace"), file=sys.stderr)
+        return
+    buf.write(data if data.endswith(b"\n") else data + b"\n")
+    buf.flush()
+
+def spawn(cmd: List[str], stdout_fd: int, stderr_fd: int) -> Callable[[], int]:
+    """
+    Start cmd (cmd[0] must be a path, not a PATH lookup) with its stdout/stderr on the
+    given fds and return a function that waits for it and returns its exit code.
+    Uses os.posix_spawn where available so the interpreter is not forked.
+    """
+    if not hasattr(os, "posix_spawn"):
+        return subprocess.Popen(cmd, stdout=stdout_fd, stderr=stderr_fd).wait
+    pid = os.posix_spawn(cmd[0], cmd, os.environ, file_actions=[
+        (os.POSIX_SPAWN_DUP2, stdout_fd, 1),
+        (os.POSIX_SPAWN_DUP2, stderr_fd, 2),
+    ])
+    return lambda: os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+def call_arch(arch_path: Path, src: Path, out_pkg: Path, keep_temp: bool = False) -> Tuple[int, Optional[str]]:
+    """
+    Run `arch pack - <src>` and stream the archive from its stdout into out_pkg, hashing
+    it on the way so the package never has to be read back from disk.
+    The archive is written to a temp file and renamed over out_pkg only on success,
+    i.e. when arch exits 0 and the stream starts with a complete arch header.
+    Returns (returncode, sha256 hex or None on failure).
+    """
+    cmd = [str(arch_path), "pack", "-", str(src)]
+    print("Running arch:", " ".join(cmd), ">", out_pkg, file=sys.stderr)
+    tmp_pkg = out_pkg.with_name(out_pkg.name + ".tmp")
+    rc = 1
     try:
-        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        # print stdout/stderr for CI visibility
-        if res.stdout:
-            print("arch stdout:", res.stdout, file=sys.stderr)
-        if res.stderr:
-            print("arch stderr:", res.stderr, file=sys.stderr)
-        return res.returncode
+        h = hashlib.sha256()
+        head = b""
+        with tempfile.TemporaryFile() as err:
+            rfd, wfd = os.pipe()
+            with os.fdopen(rfd, "rb") as pipe:
+                try:
+                    wait = spawn(cmd, wfd, err.fileno())
+                finally:
+                    os.close(wfd)
+                with tmp_pkg.open("wb") as out:
+                    for chunk in iter(lambda: pipe.read(1 << 20), b""):
+                        if len(head) < ARCH_HEADER_LEN:
+                            head += chunk[:ARCH_HEADER_LEN - len(head)]
+                        h.update(chunk)
+                        out.write(chunk)
+            rc = wait()
+            err.seek(0)
+            stderr = err.read()
+        # print arch diagnostics for CI visibility
+        if stderr:
+            echo_output("arch stderr: ", stderr)
+        if rc == 0 and (len(head) < ARCH_HEADER_LEN or not head.startswith(ARCH_MAGIC)):
+            # e.g. an arch that doesn't know `pack -` writes to a file named "-" and prints text
+            print("ERROR: arch output is not an arch archive (bad or missing header)", file=sys.stderr)
+            rc = 4
+        if rc == 0:
+            os.replace(tmp_pkg, out_pkg)
+            return 0, h.hexdigest()
     except Exception as e:
         print("arch invocation failed:", e, file=sys.stderr)
-        return 1
+    if not keep_temp:
+        tmp_pkg.unlink(missing_ok=True)
+    return rc or 1, None
+
+def finish_pkg(out_pkg: Path, manifest_path: Path, sha: Optional[str] = None) -> int:
+    """
+    Record the sha256 of a freshly packed out_pkg in manifest_path, hashing the
+    package first if 'sha' was not already computed. Returns an exit code.
+    """
+    # compute sha256
+    if sha is None:
+        try:
+            sha = compute_sha256(out_pkg)
+        except Exception as e:
+            print("ERROR computing SHA256:", e, file=sys.stderr)
+            return 5
+    print("SHA256:", sha)
+
+    # update manifest archive_sha256
+    try:
+        update_manifest_archive_sha(manifest_path, sha)
+        print("Updated manifest archive_sha256 in", manifest_path)
+    except Exception as e:
+        print("Warning: failed to update manifest:", e, file=sys.stderr)
+
+    print("Wrote package:", out_pkg)
+    return 0
 
 # -------- main flow --------
 
@@ -130,6 +291,7 @@ def main(argv):
     ap.add_argument("src_dir", help="source directory: pkgs/src/<name>/<ver>")
     ap.add_argument("--out-root", default="pkgs", help="output root (default: pkgs)")
     ap.add_argument("--keep-temp", action="store_true", help="keep temporary files on error")
+    ap.add_argument("--batch-file", help="queue the package in FILE for scripts/pack_batch.py instead of running arch")
     args = ap.parse_args(argv)
 
     src = Path(args.src_dir).resolve()
@@ -161,6 +323,12 @@ def main(argv):
     # ensure parent dir exists
     ensure_parent(out_pkg)
 
+    if args.batch_file:
+        with open(args.batch_file, "a", encoding="utf-8") as bf:
+            bf.write(f"{out_pkg.resolve()}\t{src}\n")
+        print("Queued", out_pkg, "in batch file", args.batch_file, file=sys.stderr)
+        return 0
+
     # Always use build/arch. Try to find or compile it.
     try:
         arch_path = arch_executable()
@@ -168,30 +336,13 @@ def main(argv):
         print("ERROR: could not obtain build/arch:", e, file=sys.stderr)
         return 3
 
-    rc = call_arch(arch_path, src, out_pkg)
-    if rc != 0 or not out_pkg.is_file():
+    rc, sha = call_arch(arch_path, src, out_pkg, keep_temp=args.keep_temp)
+    if rc != 0 or sha is None or not out_pkg.is_file():
         print(f"ERROR: build/arch failed (rc={rc}) or did not produce {out_pkg}", file=sys.stderr)
         return 4
 
     print("arch succeeded, produced:", out_pkg, file=sys.stderr)
-
-    # compute sha256
-    try:
-        sha = compute_sha256(out_pkg)
-        print("SHA256:", sha)
-    except Exception as e:
-        print("ERROR computing SHA256:", e, file=sys.stderr)
-        return 5
-
-    # update manifest archive_sha256
-    try:
-        update_manifest_archive_sha(manifest_path, sha)
-        print("Updated manifest archive_sha256 in", manifest_path)
-    except Exception as e:
-        print("Warning: failed to update manifest:", e, file=sys.stderr)
-
-    print("Wrote package:", out_pkg)
-    return 0
+    return finish_pkg(out_pkg, manifest_path, sha)
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv[1:]))
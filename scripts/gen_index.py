@@ -13,61 +13,99 @@ Outputs:
 Behavior:
   - Creates docs/ subdirs as needed.
   - Overwrites existing manifest.acl and index.acl.
-  - SHA256 is computed as lowercase hex using the project's src/sha256.c (built and run).
+  - SHA256 is computed as lowercase hex with hashlib (shared with create_pkg.py).
+  - SHA256s are cached in scripts/tools/sha_cache.json (--sha-cache FILE to relocate,
+    --no-sha-cache to disable) keyed by path, size and mtime, so unchanged packages
+    are not re-hashed on later runs.
   - Uses hardcoded release URL bases:
       Index base:  https://atlaslinux.github.io/pandora/
       Manifest pkg base: https://github.com/atlaslinux/pandora
 """
 from __future__ import annotations
 import argparse
-import sys
-import subprocess
+import json
 import os
+import sys
 import re
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterable, List, Tuple, Optional
+from urllib.parse import quote
+
+# file hashing is shared with create_pkg.py so both scripts stay in sync
+from create_pkg import compute_sha256 as _hash_file
+
+INDEX_BASE = "https://atlaslinux.github.io/pandora/"
+MANIFEST_PKG_BASE = "https://github.com/atlaslinux/pandora"
+# release assets live at <RELEASE_BASE><name>-<version>/<file>.pkg
+RELEASE_BASE = f"{MANIFEST_PKG_BASE}/releases/download/"
 
-# --- compute_sha256 replaced to compile and run ../src/sha256.c (which has main) ---
 SCRIPT_DIR = Path(__file__).resolve().parent
-SRC_SHA256_C = (SCRIPT_DIR / ".." / "src" / "sha256.c").resolve()
-TOOLS_DIR = SCRIPT_DIR / "tools"
-TOOL_BIN = (TOOLS_DIR / "sha256_c_bin").resolve()
-CC = os.environ.get("CC", "cc")
-CFLAGS = os.environ.get("CFLAGS", "-O2 -std=c11 -I" + str(SRC_SHA256_C.parent))
+SHA_CACHE_FILE = SCRIPT_DIR / "tools" / "sha_cache.json"
+# below this many packages, hashing serially beats starting a worker pool
+PARALLEL_HASH_MIN = 4
+# likewise for writing manifests, which are tiny
+PARALLEL_WRITE_MIN = 16
+
+# "scheme://" prefix that marks a package reference as a URL rather than a local path
+_URL_RE = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*://')
 
 _INPUT_PKG_ROOT: Optional[Path] = None
 
-def build_sha256_binary():
-    TOOLS_DIR.mkdir(parents=True, exist_ok=True)
-    needs_build = True
-    if TOOL_BIN.exists():
-        bin_mtime = TOOL_BIN.stat().st_mtime
+# sha256 results keyed by resolved path -> (size, mtime_ns, sha256); persisted in SHA_CACHE_FILE
+_SHA_CACHE: Dict[str, Tuple[int, int, str]] = {}
+
+def load_sha_cache(cache_file: Path) -> None:
+    """Seed the sha256 cache from cache_file. A missing or unreadable cache is ignored."""
+    try:
+        data = json.loads(cache_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return
+    if not isinstance(data, dict):
+        return
+    for key, entry in data.items():
         try:
-            src_mtime = SRC_SHA256_C.stat().st_mtime
-        except FileNotFoundError:
-            raise RuntimeError(f"Missing source SHA256 C file: {SRC_SHA256_C}")
-        if src_mtime <= bin_mtime:
-            needs_build = False
-    if not needs_build:
-        return TOOL_BIN
-    cmd = [CC] + CFLAGS.split() + [str(SRC_SHA256_C), "-o", str(TOOL_BIN)]
-    subprocess.check_call(cmd)
-    TOOL_BIN.chmod(TOOL_BIN.stat().st_mode | 0o111)
-    return TOOL_BIN
+            size, mtime_ns, sha = entry
+            _SHA_CACHE[key] = (int(size), int(mtime_ns), str(sha))
+        except (TypeError, ValueError):
+            continue
+
+def save_sha_cache(cache_file: Path, paths: Iterable[Path]) -> None:
+    """
+    Write the cache entries for 'paths' (the packages hashed this run) to cache_file via a
+    temp file + atomic rename. Entries for any other path are dropped, so the cache only
+    ever describes the current tree.
+    """
+    keep = {str(p.resolve()) for p in paths}
+    entries = {k: list(v) for k, v in sorted(_SHA_CACHE.items()) if k in keep}
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_file.with_name(cache_file.name + ".tmp")
+    tmp.write_text(json.dumps(entries, indent=1) + "\n", encoding="utf-8")
+    os.replace(tmp, cache_file)
+
+# basename -> first matching file under _INPUT_PKG_ROOT, built on first lookup
+_BASENAME_INDEX: Optional[Dict[str, Path]] = None
 
 def _find_local_pkg_by_name(pkg_name: str) -> Optional[Path]:
     """Search the input pkg root for a file with basename == pkg_name and return its Path, or None."""
-    global _INPUT_PKG_ROOT
+    global _INPUT_PKG_ROOT, _BASENAME_INDEX
     if not _INPUT_PKG_ROOT:
         return None
-    for p in _INPUT_PKG_ROOT.rglob(pkg_name):
-        if p.is_file():
-            return p
-    return None
+    if _BASENAME_INDEX is None:
+        # walk the tree once; later lookups are dict hits instead of a full rglob each
+        index: Dict[str, Path] = {}
+        for dirpath, dirnames, filenames in os.walk(_INPUT_PKG_ROOT):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                index.setdefault(fn, Path(dirpath) / fn)
+        _BASENAME_INDEX = index
+    return _BASENAME_INDEX.get(pkg_name)
 
 def compute_sha256(path: Path) -> str:
     """
-    Compute sha256 by compiling and running ../src/sha256.c (which contains main).
+    Compute the lowercase hex sha256 of a package file using hashlib.
+    Results are memoized per (path, size, mtime), so unchanged files are not re-hashed.
     If 'path' doesn't exist and looks like a URL or filename, attempt to locate the
     local package file (by basename) under the input directory before failing.
     """
@@ -77,7 +115,7 @@ def compute_sha256(path: Path) -> str:
     # If the path exists locally, use it directly
     if not path.exists():
         path_str = str(orig)
-        m = re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', path_str)
+        m = _URL_RE.match(path_str)
         basename = Path(path_str).name
         found = None
         if m:
@@ -94,15 +132,14 @@ def compute_sha256(path: Path) -> str:
             raise RuntimeError(f"Cannot find local package file for '{orig}'. Searched for basename '{basename}' under {_INPUT_PKG_ROOT}")
         path = found
 
-    binpath = build_sha256_binary()
-    proc = subprocess.run([str(binpath), str(path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if proc.returncode != 0:
-        raise RuntimeError(f"sha256 binary failed for {path}: rc={proc.returncode} stderr={proc.stderr.strip()}")
-    hex = proc.stdout.strip()
-    if len(hex) != 64:
-        raise RuntimeError(f"sha256 binary output invalid for {path}: '{hex}'")
-    return hex
-# --- end replacement ---
+    st = path.stat()
+    key = str(path.resolve())
+    entry = _SHA_CACHE.get(key)
+    if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+        return entry[2]
+    sha = _hash_file(path)
+    _SHA_CACHE[key] = (st.st_size, st.st_mtime_ns, sha)
+    return sha
 
 
 def find_pkgs(input_dir: Path) -> Dict[str, List[Tuple[str, Path]]]:
@@ -115,95 +152,177 @@ def find_pkgs(input_dir: Path) -> Dict[str, List[Tuple[str, Path]]]:
     pkgs: Dict[str, List[Tuple[str, Path]]] = {}
     if not input_dir.exists():
         return pkgs
-    for name_dir in sorted(input_dir.iterdir()):
-        if not name_dir.is_dir():
-            continue
-        name = name_dir.name
-        for ver_dir in sorted(name_dir.iterdir()):
-            if not ver_dir.is_dir():
-                continue
-            version = ver_dir.name
-            pkg_files = sorted([p for p in ver_dir.iterdir() if p.is_file() and p.suffix == ".pkg"])
+    # os.scandir entries answer is_dir()/is_file() from the directory listing, avoiding a stat per entry
+    with os.scandir(input_dir) as it:
+        name_dirs = sorted((e for e in it if e.is_dir()), key=lambda e: e.name)
+    for name_entry in name_dirs:
+        name = name_entry.name
+        with os.scandir(name_entry.path) as it:
+            ver_dirs = sorted((e for e in it if e.is_dir()), key=lambda e: e.name)
+        for ver_entry in ver_dirs:
+            version = ver_entry.name
+            with os.scandir(ver_entry.path) as it:
+                # plain string test on the name first (a bare ".pkg" dotfile has no suffix), then the type check
+                pkg_files = sorted((e for e in it if e.name.endswith(".pkg") and e.name != ".pkg" and e.is_file()),
+                                   key=lambda e: e.name)
             if not pkg_files:
                 continue
             # Prefer exact filename "<name>-<version>.pkg"
             expected_name = f"{name}-{version}.pkg"
-            exact = None
-            for p in pkg_files:
-                if p.name == expected_name:
-                    exact = p
-                    break
-            pkg_path = exact if exact else pkg_files[0]
+            chosen = next((e for e in pkg_files if e.name == expected_name), pkg_files[0])
+            pkg_path = Path(chosen.path)
             pkgs.setdefault(name, []).append((version, pkg_path))
     return pkgs
 
 
-def write_manifest(out_manifest: Path, name: str, version: str, sha256: str, pkg_url: str):
-    out_manifest.parent.mkdir(parents=True, exist_ok=True)
-    content = []
-    content.append('Manifest {')
-    content.append(f'    string name = "{name}";')
-    content.append(f'    string version = "{version}";')
-    content.append(f'    string sha256 = "{sha256}";')
-    content.append(f'    string pkg_url = "{pkg_url}";')
-    content.append('    bool signed = false;')
-    content.append('}')
-    out_manifest.write_text("\n".join(content) + "\n", encoding="utf-8")
+def _acl_quote(s: str) -> str:
+    """Return s as a double-quoted ACL string literal, escaping backslashes and quotes."""
+    return '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _acl_comment(s: str) -> str:
+    """Make s safe to embed in a /* ... */ ACL comment."""
+    return s.replace("*/", "* /")
+
 
+def _url_part(s: str) -> str:
+    """Percent-encode s for use as a single URL path segment."""
+    return quote(s, safe="")
 
-def generate_index(out_dir: Path, pkgs: Dict[str, List[Tuple[str, Path]]]):
+
+def write_manifest(out_manifest: Path, name: str, version: str, sha256: str, pkg_url: str) -> Path:
+    """Write one manifest.acl; its parent directory must already exist (see write_manifests)."""
+    with out_manifest.open("w", encoding="utf-8") as fp:
+        fp.write('Manifest {\n')
+        fp.write(f'    string name = {_acl_quote(name)};\n')
+        fp.write(f'    string version = {_acl_quote(version)};\n')
+        fp.write(f'    string sha256 = "{sha256}";\n')
+        fp.write(f'    string pkg_url = {_acl_quote(pkg_url)};\n')
+        fp.write('    bool signed = false;\n')
+        fp.write('}\n')
+    return out_manifest
+
+
+def write_manifests(out_dir: Path, pkgs: Dict[str, List[Tuple[str, Path]]], shas: Dict[Path, str]) -> List[Path]:
+    """
+    Write docs/pkgs/<name>/<ver>/manifest.acl for every package and return the written paths.
+    Each write is independent file I/O, so they are spread over a thread pool.
+    """
+    tasks = []
+    for name, entries in pkgs.items():
+        release_prefix = f'{RELEASE_BASE}{_url_part(name)}-'
+        # create docs/pkgs/<name> once, then each version dir without re-walking its parents
+        name_dir = out_dir / "pkgs" / name
+        name_dir.mkdir(parents=True, exist_ok=True)
+        for ver, pkgpath in entries:
+            ver_dir = name_dir / ver
+            ver_dir.mkdir(exist_ok=True)
+            manifest_path = ver_dir / "manifest.acl"
+            pkg_url = f'{release_prefix}{_url_part(ver)}/{_url_part(pkgpath.name)}'
+            tasks.append((manifest_path, name, ver, shas[pkgpath], pkg_url))
+    if len(tasks) < PARALLEL_WRITE_MIN:
+        return [write_manifest(*t) for t in tasks]
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        return list(ex.map(lambda t: write_manifest(*t), tasks))
+
+
+def hash_pkgs(pkgs: Dict[str, List[Tuple[str, Path]]]) -> Dict[Path, str]:
+    """
+    Compute the sha256 of every discovered package file, keyed by its path.
+    hashlib releases the GIL while hashing, so a thread pool spreads the work across cores
+    (and keeps results in this process's sha cache); a handful of files is hashed inline.
+    """
+    paths = [pkgpath for entries in pkgs.values() for _, pkgpath in entries]
+    if len(paths) < PARALLEL_HASH_MIN:
+        return {p: compute_sha256(p) for p in paths}
+    workers = min(32, (os.cpu_count() or 1) * 2)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return dict(zip(paths, ex.map(compute_sha256, paths)))
+
+
+# index.acl is emitted from these fixed-shape templates, one format call per block.
+# Registry header with its metadata, followed by a blank line
+_REGISTRY_HEADER = f'''\
+Registry {{
+    string url = "{INDEX_BASE}index.acl";
+    int priority = 100;
+    bool require_signatures = false;
+    string cache_policy = "ttl=3600";
+
+'''
+
+# opening of a Package block, up to its first Version sub-block
+_PACKAGE_TMPL = '''\
+    /* {comment_name} package */
+    Package {qname} {{
+        string[] versions = {{ {versions_list} }};
+        string latest = {latest};
+        string pkg_base_url = "";
+
+'''
+
+# closing of a Package block, followed by a blank line
+_PACKAGE_FOOTER = '''\
+    }
+
+'''
+
+# one Version sub-block of a Package, including its trailing blank line
+_VERSION_TMPL = '''\
+        Version {qver} {{
+            string manifest_url = {manifest_url};
+            string pkg_url = {pkg_url};
+            string sha256 = "{sha}";
+            bool deprecated = false;
+        }}
+
+'''
+
+
+def generate_index(out_dir: Path, pkgs: Dict[str, List[Tuple[str, Path]]], shas: Dict[Path, str]):
     """
     Generate index.acl where the Registry.url is fixed to:
       https://atlaslinux.github.io/pandora/index.acl
 
+    'shas' maps every package path in 'pkgs' to its sha256 (see hash_pkgs); nothing is hashed here.
+
     Manifests will contain pkg_url values prefixed with:
       https://github.com/atlaslinux/pandora
     """
     out_dir.mkdir(parents=True, exist_ok=True)
-    index_lines: List[str] = []
-
-    INDEX_BASE = "https://atlaslinux.github.io/pandora/"
-    MANIFEST_PKG_BASE = "https://github.com/atlaslinux/pandora"
-
-    # Open Registry block and include metadata
-    index_lines.append("Registry {")
-    index_lines.append(f'    string url = "{INDEX_BASE}index.acl";')
-    index_lines.append("    int priority = 100;")
-    index_lines.append("    bool require_signatures = false;")
-    index_lines.append('    string cache_policy = "ttl=3600";')
-    index_lines.append("")  # blank line inside Registry for readability
-
-    # For deterministic output, iterate sorted names and versions (versions sorted reverse lexicographic)
-    for name in sorted(pkgs.keys()):
-        versions = sorted([v for v, p in pkgs[name]], reverse=True)
-        index_lines.append(f'    /* {name} package */')
-        index_lines.append(f'    Package "{name}" {{')
-        versions_list = ", ".join(f'"{v}"' for v in versions)
-        index_lines.append(f'        string[] versions = {{ {versions_list} }};')
-        index_lines.append(f'        string latest = "{versions[0]}";')
-        index_lines.append('        string pkg_base_url = "";')
-        index_lines.append('')
-        # include Version sub-blocks
-        for (ver, pkgpath) in sorted(pkgs[name], key=lambda x: x[0], reverse=True):
-            sha = compute_sha256(pkgpath)
-            manifest_rel = f'pkgs/{name}/{ver}/manifest.acl'
-            manifest_url = INDEX_BASE + manifest_rel
-            pkg_url = f'{MANIFEST_PKG_BASE}/releases/download/{name}-{ver}/{pkgpath.name}'
-            index_lines.append(f'        Version "{ver}" {{')
-            index_lines.append(f'            string manifest_url = "{manifest_url}";')
-            index_lines.append(f'            string pkg_url = "{pkg_url}";')
-            index_lines.append(f'            string sha256 = "{sha}";')
-            index_lines.append('            bool deprecated = false;')
-            index_lines.append('        }')
-            index_lines.append('')
-        index_lines.append('    }')
-        index_lines.append('')  # blank after each Package
-
-    # Close Registry block
-    index_lines.append("}")
 
+    # Stream the index through a large write buffer instead of holding every line in memory;
+    # write to a temp file and rename so a failed run never leaves a truncated index.acl.
     index_path = out_dir / "index.acl"
-    index_path.write_text("\n".join(index_lines) + "\n", encoding="utf-8")
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8", buffering=1 << 20) as fp:
+        # Open Registry block and include metadata
+        fp.write(_REGISTRY_HEADER)
+
+        # For deterministic output, iterate sorted names and versions (versions sorted reverse lexicographic)
+        for name in sorted(pkgs.keys()):
+            entries = sorted(pkgs[name], key=itemgetter(0), reverse=True)
+            # quote each name/version once and reuse it in the Package header and Version blocks
+            qversions = [_acl_quote(v) for v, _ in entries]
+            versions_list = ", ".join(qversions)
+            fp.write(_PACKAGE_TMPL.format(comment_name=_acl_comment(name), qname=_acl_quote(name), versions_list=versions_list,
+                                          latest=qversions[0]))
+            # include Version sub-blocks; URL prefixes are fixed per package, so build them once.
+            # URL path segments are percent-encoded, and the finished URLs ACL-quoted.
+            uname = _url_part(name)
+            manifest_prefix = f'{INDEX_BASE}pkgs/{uname}/'
+            release_prefix = f'{RELEASE_BASE}{uname}-'
+            for (ver, pkgpath), qver in zip(entries, qversions):
+                sha = shas[pkgpath]
+                uver = _url_part(ver)
+                manifest_url = _acl_quote(f'{manifest_prefix}{uver}/manifest.acl')
+                pkg_url = _acl_quote(f'{release_prefix}{uver}/{_url_part(pkgpath.name)}')
+                fp.write(_VERSION_TMPL.format(qver=qver, manifest_url=manifest_url, pkg_url=pkg_url, sha=sha))
+            fp.write(_PACKAGE_FOOTER)
+
+        # Close Registry block
+        fp.write("}\n")
+    os.replace(tmp_path, index_path)
     return index_path
 
 
@@ -211,14 +330,18 @@ def main(argv):
     ap = argparse.ArgumentParser(description="Generate index.acl and manifests from pkgs workspace")
     ap.add_argument("--input", "-i", required=True, help="pkgs input dir")
     ap.add_argument("--out", "-o", required=True, help="docs output dir")
+    ap.add_argument("--sha-cache", default=str(SHA_CACHE_FILE),
+                    help=f"sha256 cache file reused across runs (default: {SHA_CACHE_FILE})")
+    ap.add_argument("--no-sha-cache", action="store_true", help="hash every package and don't read or write the cache")
     args = ap.parse_args(argv)
 
     input_dir = Path(args.input)
     out_dir = Path(args.out)
 
     # allow compute_sha256 to search the workspace when given URLs
-    global _INPUT_PKG_ROOT
+    global _INPUT_PKG_ROOT, _BASENAME_INDEX
     _INPUT_PKG_ROOT = input_dir.resolve()
+    _BASENAME_INDEX = None
 
     pkgs = find_pkgs(input_dir)
     if not pkgs:
@@ -226,22 +349,24 @@ def main(argv):
         sys.exit(1)
 
     # Write manifests and compute SHAs (manifests live under docs/pkgs/...)
-    MANIFEST_PKG_BASE = "https://github.com/atlaslinux/pandora"
-    INDEX_BASE = "https://atlaslinux.github.io/pandora/"
-
-    for name, entries in pkgs.items():
-        for ver, pkgpath in entries:
-            sha = compute_sha256(pkgpath)
-            manifest_path = out_dir / "pkgs" / name / ver / "manifest.acl"
-            pkg_url = f'{MANIFEST_PKG_BASE}/releases/download/{name}-{ver}/{pkgpath.name}'
-            write_manifest(manifest_path, name, ver, sha, pkg_url)
+    sha_cache = None if args.no_sha_cache else Path(args.sha_cache)
+    if sha_cache:
+        load_sha_cache(sha_cache)
+    shas = hash_pkgs(pkgs)
+    if sha_cache:
+        try:
+            save_sha_cache(sha_cache, shas.keys())
+        except OSError as e:
+            print("Warning: could not write sha cache:", e, file=sys.stderr)
+    # track outputs as they are written rather than re-walking out_dir afterwards
+    written = write_manifests(out_dir, pkgs, shas)
 
     # Generate index.acl with Package blocks inside Registry
-    index_path = generate_index(out_dir, pkgs)
+    index_path = generate_index(out_dir, pkgs, shas)
+    written.append(index_path)
     print("Wrote index:", index_path)
-    for p in sorted(out_dir.rglob("*")):
-        if p.is_file():
-            print("WROTE", p)
+    for p in sorted(written):
+        print("WROTE", p)
     return 0
 
 
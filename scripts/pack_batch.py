@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# scripts/pack_batch.py
+"""
+Pack every package queued by `create_pkg.py --batch-file FILE` with a single build/arch process.
+
+Usage:
+  scripts/pack_batch.py <batch_file>
+
+Behavior:
+- Each line of <batch_file> is "<out_pkg>\t<src_dir>", as written by create_pkg.py.
+- Runs `build/arch pack-many` once with the batch file on stdin.
+- Then computes each package's SHA256 and updates archive_sha256 in its manifest.acl.
+- Exits non-zero if arch fails or any queued package was not produced; packages that
+  were produced are still hashed and recorded.
+"""
+from __future__ import annotations
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+from create_pkg import arch_executable, find_manifest, finish_pkg, is_arch_archive
+
+
+def read_batch(batch_file: Path) -> List[Tuple[Path, Path]]:
+    entries: List[Tuple[Path, Path]] = []
+    for line in batch_file.read_text(encoding="utf-8").splitlines():
+        if not line:
+            continue
+        out_pkg, sep, src = line.partition("\t")
+        if not sep:
+            raise ValueError(f"malformed batch line: {line!r}")
+        entries.append((Path(out_pkg), Path(src)))
+    return entries
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description="Pack all packages queued in a batch file with one arch process")
+    ap.add_argument("batch_file", help="batch file written by create_pkg.py --batch-file")
+    args = ap.parse_args(argv)
+
+    batch_file = Path(args.batch_file)
+    try:
+        entries = read_batch(batch_file)
+    except (OSError, ValueError) as e:
+        print("ERROR reading batch file:", e, file=sys.stderr)
+        return 2
+    if not entries:
+        print("Nothing queued in", batch_file, file=sys.stderr)
+        return 0
+
+    try:
+        arch_path = arch_executable()
+    except Exception as e:
+        print("ERROR: could not obtain build/arch:", e, file=sys.stderr)
+        return 3
+
+    # remove stale outputs so a failed pack cannot be mistaken for a fresh one
+    for out_pkg, _ in entries:
+        out_pkg.unlink(missing_ok=True)
+
+    cmd = [str(arch_path), "pack-many"]
+    print("Running arch:", " ".join(cmd), "<", batch_file, file=sys.stderr)
+    with batch_file.open("rb") as stdin:
+        rc = subprocess.run(cmd, stdin=stdin).returncode
+    status = 0
+    if rc != 0:
+        # arch skips bad entries and keeps going, so still finish whatever it did produce
+        print(f"ERROR: build/arch pack-many failed (rc={rc})", file=sys.stderr)
+        status = 4
+
+    for out_pkg, src in entries:
+        if not is_arch_archive(out_pkg):
+            print(f"ERROR: build/arch did not produce {out_pkg}", file=sys.stderr)
+            status = status or 4
+            continue
+        try:
+            manifest_path = find_manifest(src)
+        except FileNotFoundError as e:
+            print("ERROR:", e, file=sys.stderr)
+            status = status or 2
+            continue
+        rc = finish_pkg(out_pkg, manifest_path)
+        status = status or rc
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
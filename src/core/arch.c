@@ -1,8 +1,10 @@
 /* arch - simple .pnd archive packer/unpacker
  *
  * Usage:
- *   ./arch pack archive.pnd path1 [path2 ...]
+ *   ./arch pack archive.pnd path1 [path2 ...]   (archive.pnd may be "-" for stdout)
+ *   ./arch pack-many < list     (one "archive.pnd<TAB>path" pair per line)
  *   ./arch unpack archive.pnd [destdir]
+ *   ./arch --version            (prints "arch <ARCH_VERSION>")
  *
  * Notes:
  * - Stores regular files and symlinks.
@@ -36,6 +38,10 @@
 #include <stdarg.h>
 #include <limits.h>
 
+/* bumped when the CLI gains features callers depend on; reported by --version.
+ * 2: `pack -` streams the archive to stdout, and `pack-many` exists */
+#define ARCH_VERSION 2
+
 #define MAGIC "PNDARCH\1"
 #define MAGIC_LEN 8
 #define ENTRY_HDR_SIZE (4 + 8 + 8 + 4) /* u32 path_len, u64 size, u64 offset, u32 flags */
@@ -247,8 +253,9 @@ static void do_pack(int argc, char **argv) {
         cur_offset += g_recs[i].size;
     }
 
-    /* open archive file (atomic write recommended by caller) */
-    FILE *out = fopen(arcname, "wb");
+    /* open archive file (atomic write recommended by caller); "-" streams to stdout */
+    bool to_stdout = strcmp(arcname, "-") == 0;
+    FILE *out = to_stdout ? stdout : fopen(arcname, "wb");
     if (!out) die("fopen '%s' for write: %s", arcname, strerror(errno));
 
     /* write magic */
@@ -291,6 +298,12 @@ static void do_pack(int argc, char **argv) {
         }
     }
 
+    if (to_stdout) {
+        /* stdout carries the archive, so report on stderr */
+        if (fflush(out) != 0) die("flush failed");
+        fprintf(stderr, "packed %zu entries to stdout\n", g_rec_cnt);
+        return;
+    }
     if (fclose(out) != 0) die("fclose failed");
     printf("packed %zu entries into %s\n", g_rec_cnt, arcname);
 }
@@ -589,15 +602,75 @@ void do_unpack(int argc, char **argv) {
 }
 
 #ifndef PANDORA
+/* free recorded src/path entries so the record list can be reused */
+static void free_recs(void) {
+    for (size_t i = 0; i < g_rec_cnt; ++i) {
+        free(g_recs[i].path);
+        free(g_recs[i].src);
+    }
+    g_rec_cnt = 0;
+}
+
+/* pack-many: read "<archive.pnd>\t<file-or-dir>" lines from stdin and pack each,
+ * so many packages can be built by one process instead of one process each.
+ * die() does not exit, so every entry is checked up front and bad ones are skipped
+ * rather than handed to do_pack; returns the number of skipped entries. */
+static size_t do_pack_many(void) {
+    char *line = NULL;
+    size_t cap = 0;
+    ssize_t len;
+    size_t failed = 0;
+    while ((len = getline(&line, &cap, stdin)) != -1) {
+        if (len > 0 && line[len - 1] == '\n') line[--len] = '\0';
+        if (len == 0) continue;
+        char *tab = strchr(line, '\t');
+        if (!tab) {
+            die("pack-many: malformed line '%s' (expected <archive.pnd>\\t<file-or-dir>)", line);
+            failed++;
+            continue;
+        }
+        *tab = '\0';
+        const char *arcname = line;
+        const char *src = tab + 1;
+        struct stat st;
+        if (lstat(src, &st) < 0) {
+            die("pack-many: skipping '%s': lstat '%s': %s", arcname, src, strerror(errno));
+            failed++;
+            continue;
+        }
+        FILE *probe = fopen(arcname, "ab");
+        if (!probe) {
+            die("pack-many: skipping '%s': cannot open for write: %s", arcname, strerror(errno));
+            failed++;
+            continue;
+        }
+        fclose(probe);
+        char *pack_argv[] = { "pack", (char *)arcname, (char *)src };
+        do_pack(3, pack_argv);
+        free_recs();
+    }
+    free(line);
+    return failed;
+}
+
 /* main: simple CLI dispatch */
 int main(int argc, char **argv) {
     if (argc < 2) {
-        fprintf(stderr, "usage:\n  %s pack <archive.pnd> <file-or-dir>...\n  %s unpack <archive.pnd> [destdir]\n", argv[0], argv[0]);
+        fprintf(stderr, "usage:\n  %s pack <archive.pnd> <file-or-dir>...\n  %s pack-many < list\n  %s unpack <archive.pnd> [destdir]\n", argv[0], argv[0], argv[0]);
         return EXIT_FAILURE;
     }
+    if (strcmp(argv[1], "--version") == 0) {
+        printf("arch %d\n", ARCH_VERSION);
+        return EXIT_SUCCESS;
+    }
     if (strcmp(argv[1], "pack") == 0) {
         /* shift argv so pack sees argv[1]=archive */
         do_pack(argc - 1, argv + 1);
+    } else if (strcmp(argv[1], "pack-many") == 0) {
+        if (do_pack_many() != 0) {
+            free(g_recs);
+            return EXIT_FAILURE;
+        }
     } else if (strcmp(argv[1], "unpack") == 0) {
         do_unpack(argc - 1, argv + 1);
     } else {
@@ -605,11 +678,7 @@ int main(int argc, char **argv) {
         return EXIT_FAILURE;
     }
 
-    /* free recorded src/path entries */
-    for (size_t i = 0; i < g_rec_cnt; ++i) {
-        free(g_recs[i].path);
-        free(g_recs[i].src);
-    }
+    free_recs();
     free(g_recs);
 
     return EXIT_SUCCESS;